@@ -12,24 +12,48 @@
 #
 import enum
 import json
+import math
 import os
+import queue
 import shutil
 import tarfile
+import threading
+import weakref
 import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from os import makedirs
 from os.path import isdir, join, exists
 from tempfile import mkstemp
 
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 from ovos_bus_client.message import Message
 from ovos_bus_client.util import get_mycroft_bus
 from ovos_plugin_manager.templates.hotwords import HotWordEngine
 from ovos_utils.log import LOG
-from ovos_utils.parse import fuzzy_match, MatchStrategy
 from ovos_utils.xdg_utils import xdg_data_home
+from rapidfuzz import fuzz, process
 from speech_recognition import AudioData
 from vosk import Model as KaldiModel, KaldiRecognizer
 
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson is optional, fall back to the stdlib parser
+    from json import loads as json_loads
+
+try:
+    import ahocorasick
+except ImportError:  # pyahocorasick is optional, samples are scanned one by one
+    ahocorasick = None
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional, energy is computed with numpy
+    njit = None
+
 
 class MatchRule(str, enum.Enum):
     CONTAINS = "contains"
@@ -43,18 +67,211 @@ class MatchRule(str, enum.Enum):
     PARTIAL_TOKEN_SORT_RATIO = "partial_token_sort_ratio"
 
 
+# rapidfuzz scorers for the fuzzy rules, scores are in the 0-100 range
+_FUZZY_SCORERS = {
+    MatchRule.FUZZY: fuzz.ratio,
+    MatchRule.TOKEN_SET_RATIO: fuzz.token_set_ratio,
+    MatchRule.TOKEN_SORT_RATIO: fuzz.token_sort_ratio,
+    MatchRule.PARTIAL_TOKEN_SET_RATIO: fuzz.partial_token_set_ratio,
+    MatchRule.PARTIAL_TOKEN_SORT_RATIO: fuzz.partial_token_sort_ratio
+}
+
+# keyword names use _ and - as word separators, translated in a single pass
+_KW_NAME_TABLE = str.maketrans("_-", "  ")
+
+# exact string rules, called as matcher(transcript, sample)
+_STRING_MATCHERS = {
+    MatchRule.CONTAINS: str.__contains__,
+    MatchRule.EQUALS: str.__eq__,
+    MatchRule.STARTS: str.startswith,
+    MatchRule.ENDS: str.endswith
+}
+
+
+def min_match_len(samples, rule):
+    """ shortest transcript the exact string rules can match, fuzzy rules
+    rely on the rapidfuzz score_cutoff instead """
+    if rule in _STRING_MATCHERS:
+        return min(map(len, samples), default=0)
+    return 0
+
+
+# how vosk formats the transcription keys of its json results
+_RESULT_PREFIXES = {"text": '"text" : "', "partial": '"partial" : "'}
+
+
+def parse_result(res, key="text"):
+    """ extract a transcription from a vosk json result by slicing the
+    string, results with any other shape are parsed as json """
+    prefix = _RESULT_PREFIXES.get(key) or f'"{key}" : "'
+    start = res.find(prefix)
+    if start != -1:
+        # the key is the last one in the result, its value is followed by "}
+        text = res[start + len(prefix):res.rfind('"')]
+        if '"' not in text and "\\" not in text:
+            return text
+    return json_loads(res)[key]
+
+
+def build_automaton(samples, rule):
+    """ compile samples into an Aho-Corasick automaton for the
+    contains/starts/ends rules, None if not applicable """
+    if ahocorasick is None or rule not in (MatchRule.CONTAINS,
+                                           MatchRule.STARTS,
+                                           MatchRule.ENDS):
+        return None
+    # the automaton can not hold empty words, without samples it is never
+    # built and an empty sample matches any transcript in the string rules
+    if not samples or not all(samples):
+        return None
+    automaton = ahocorasick.Automaton()
+    for s in samples:
+        automaton.add_word(s, s)
+    automaton.make_automaton()
+    return automaton
+
+
+def compile_rule(samples, rule=MatchRule.FUZZY, thresh=0.75, automaton=None):
+    """ resolve the rule once into a transcript -> bool function, samples
+    are expected to be already lowercased and stripped, automaton is an
+    optional build_automaton result for those samples """
+    if automaton is not None:
+        # every sample is found in a single pass over the transcript
+        if rule == MatchRule.CONTAINS:
+            return lambda t: next(automaton.iter(t), None) is not None
+        if rule == MatchRule.STARTS:
+            return lambda t: any(end == len(s) - 1
+                                 for end, s in automaton.iter(t))
+        return lambda t: any(end == len(t) - 1 for end, _ in automaton.iter(t))
+    scorer = _FUZZY_SCORERS.get(rule)
+    if scorer:
+        cutoff = thresh * 100
+        # score all samples in a single call, None if below threshold
+        return lambda t: process.extractOne(t, samples,
+                                            scorer=scorer, processor=None,
+                                            score_cutoff=cutoff) is not None
+    if rule == MatchRule.EQUALS:
+        sample_set = frozenset(samples)
+        return sample_set.__contains__
+    matcher = _STRING_MATCHERS.get(rule)
+    if matcher:
+        def match(t):
+            for s in samples:
+                if matcher(t, s):
+                    return True
+            return False
+        return match
+    return lambda t: False
+
+
+# vosk models shared by every container, a model is unloaded once no
+# container references it anymore
+_MODEL_CACHE = weakref.WeakValueDictionary()
+_MODEL_LOCK = threading.Lock()
+
+
+def load_kaldi_model(model_path):
+    """ load a vosk model, reusing it if already loaded """
+    with _MODEL_LOCK:
+        model = _MODEL_CACHE.get(model_path)
+        if model is None:
+            model = _MODEL_CACHE[model_path] = KaldiModel(model_path)
+        return model
+
+
+# one lock per model path, concurrent plugins wait for the same download
+_DOWNLOAD_LOCKS = {}
+
+
+def download_lock(model_path):
+    """ lock serializing the download of a model path """
+    with _MODEL_LOCK:
+        return _DOWNLOAD_LOCKS.setdefault(model_path, threading.Lock())
+
+
+# grammar json per (model_path, samples), building it scans the model
+# vocabulary which is slow for big models
+_GRAMMAR_CACHE = {}
+
+
+if njit is not None:
+    # cache the compiled function on disk to avoid the jit warmup on start
+    @njit(cache=True)
+    def _rms_i16(pcm):
+        # single pass over the samples without temporary arrays
+        total = 0
+        for i in range(pcm.shape[0]):
+            v = int(pcm[i])
+            total += v * v
+        return math.sqrt(total / pcm.shape[0])
+
+
+def audio_energy(audio):
+    """ root mean square energy of 16 bit pcm audio """
+    if isinstance(audio, AudioData):
+        audio = audio.frame_data
+    pcm = np.frombuffer(audio, dtype=np.int16, count=len(audio) // 2)
+    if not pcm.size:
+        return 0.0
+    if njit is not None:
+        return _rms_i16(pcm)
+    # sum of squares accumulated in int64 without temporary arrays
+    total = np.einsum("i,i->", pcm, pcm, dtype=np.int64)
+    return math.sqrt(total / pcm.size)
+
+
+_SMALL_LANG2URL = {
+    "en": "http://alphacephei.com/vosk/models/vosk-model-small-en-us-0.15.zip",
+    "en-in": "http://alphacephei.com/vosk/models/vosk-model-small-en-in-0.4.zip",
+    "cn": "https://alphacephei.com/vosk/models/vosk-model-small-cn-0.3.zip",
+    "ru": "https://alphacephei.com/vosk/models/vosk-model-small-ru-0.15.zip",
+    "fr": "https://alphacephei.com/vosk/models/vosk-model-small-fr-pguyot-0.3.zip",
+    "de": "https://alphacephei.com/vosk/models/vosk-model-small-de-0.15.zip",
+    "es": "https://alphacephei.com/vosk/models/vosk-model-small-es-0.3.zip",
+    "pt": "https://alphacephei.com/vosk/models/vosk-model-small-pt-0.3.zip",
+    "gr": "https://alphacephei.com/vosk/models/vosk-model-el-gr-0.7.zip",
+    "tr": "https://alphacephei.com/vosk/models/vosk-model-small-tr-0.3.zip",
+    "vn": "https://alphacephei.com/vosk/models/vosk-model-small-vn-0.3.zip",
+    "it": "https://alphacephei.com/vosk/models/vosk-model-small-it-0.4.zip",
+    "nl": "https://alphacephei.com/vosk/models/vosk-model-nl-spraakherkenning-0.6-lgraph.zip",
+    "ca": "https://alphacephei.com/vosk/models/vosk-model-small-ca-0.4.zip",
+    "ar": "https://alphacephei.com/vosk/models/vosk-model-ar-mgb2-0.4.zip",
+    "fa": "https://alphacephei.com/vosk/models/vosk-model-small-fa-0.5.zip",
+    "tl": "https://alphacephei.com/vosk/models/vosk-model-tl-ph-generic-0.6.zip"
+}
+
+_BIG_LANG2URL = {
+    "en": "https://alphacephei.com/vosk/models/vosk-model-en-us-aspire-0.2.zip",
+    "en-in": "http://alphacephei.com/vosk/models/vosk-model-en-in-0.4.zip",
+    "cn": "https://alphacephei.com/vosk/models/vosk-model-cn-0.1.zip",
+    "ru": "https://alphacephei.com/vosk/models/vosk-model-ru-0.10.zip",
+    "fr": "https://github.com/pguyot/zamia-speech/releases/download/20190930/kaldi-generic-fr-tdnn_f-r20191016.tar.xz",
+    "de": "https://alphacephei.com/vosk/models/vosk-model-de-0.6.zip",
+    "nl": "https://alphacephei.com/vosk/models/vosk-model-nl-spraakherkenning-0.6.zip",
+    "fa": "https://alphacephei.com/vosk/models/vosk-model-fa-0.5.zip"
+}
+# big models with the small ones as fallback, merged once
+_BIG_LANG2URL = {**_SMALL_LANG2URL, **_BIG_LANG2URL}
+
+
 class ModelContainer:
     UNK = "[unk]"
 
-    def __init__(self, samples=None, full_vocab=False):
+    def __init__(self, samples=None, full_vocab=False, sample_rate=16000):
         if not full_vocab and not samples:
             full_vocab = True
-        samples = samples or []
+        samples = list(samples or [])
         if self.UNK not in samples:
             samples.append(self.UNK)
         self.samples = samples
         self.full_vocab = full_vocab
+        # vosk resamples audio at this rate to the model rate natively
+        self.sample_rate = sample_rate
         self.engine = None
+        # recognizers do not keep their python model object alive
+        self.kaldi_models = {}
+        # recognizers are stateful and never shared between containers
+        self.recognizers = {}
 
     def get_engine(self, lang=None):
         if not self.engine and lang:
@@ -62,33 +279,80 @@ class ModelContainer:
             self.load_language(lang)
         return self.engine
 
-    def get_partial_transcription(self, lang=None):
+    def get_result(self, lang=None, partial=False):
+        """ raw json result string returned by vosk """
         engine = self.get_engine(lang)
-        res = engine.PartialResult()
-        return json.loads(res)["partial"]
+        if partial:
+            return engine.PartialResult()
+        return engine.Result()
+
+    def get_partial_transcription(self, lang=None):
+        res = self.get_result(lang, partial=True)
+        return parse_result(res, "partial")
 
     def get_final_transcription(self, lang=None):
         engine = self.get_engine(lang)
         res = engine.FinalResult()
-        return json.loads(res)["text"]
+        return parse_result(res)
 
     def process_audio(self, audio, lang=None):
         engine = self.get_engine(lang)
         if isinstance(audio, AudioData):
-            audio = audio.get_wav_data()
+            # vosk expects headerless 16bit pcm, not a wav file
+            audio = audio.get_raw_data(convert_rate=self.sample_rate,
+                                       convert_width=2)
         return engine.AcceptWaveform(audio)
 
+    def process_raw(self, pcm, lang=None):
+        """ feed raw 16bit mono pcm at sample_rate, as delivered by the mic """
+        return self.get_engine(lang).AcceptWaveform(pcm)
+
+    def reset(self, lang=None):
+        engine = self.get_engine(lang)
+        engine.Reset()
+
     def get_model(self, model_path, samples=None):
         if model_path:
-            if self.full_vocab:
-                model = KaldiRecognizer(KaldiModel(model_path), 16000)
+            grammar = None
+            if not self.full_vocab:
+                key = (model_path, tuple(sorted(samples or self.samples)))
+                grammar = _GRAMMAR_CACHE.get(key)
+                if grammar is None:
+                    grammar = _GRAMMAR_CACHE[key] = json.dumps(
+                        self.get_grammar(model_path, key[1]))
+            model = self.recognizers.get((model_path, grammar))
+            if model is not None:
+                # reloading the same model and grammar, just clear the state
+                model.Reset()
+                return model
+            kaldi_model = load_kaldi_model(model_path)
+            self.kaldi_models[model_path] = kaldi_model
+            if grammar is None:
+                model = KaldiRecognizer(kaldi_model, self.sample_rate)
             else:
-                model = KaldiRecognizer(KaldiModel(model_path), 16000,
-                                        json.dumps(samples or self.samples))
+                model = KaldiRecognizer(kaldi_model, self.sample_rate,
+                                        grammar)
+            self.recognizers[(model_path, grammar)] = model
             return model
         else:
             raise FileNotFoundError
 
+    def get_grammar(self, model_path, samples):
+        """ deduplicated lowercase samples restricting the vosk vocabulary,
+        the smaller the grammar the faster the decoding """
+        grammar = list(dict.fromkeys(s.lower().strip() for s in samples))
+        words_file = join(model_path, "graph", "words.txt")
+        if exists(words_file):
+            with open(words_file, encoding="utf-8") as f:
+                vocab = {line.split()[0] for line in f if line.strip()}
+            oov = {w for s in grammar if s != self.UNK
+                   for w in s.split() if w not in vocab}
+            if oov:
+                # vosk silently drops these words from the grammar
+                LOG.warning(f"words missing from vosk model vocabulary, "
+                            f"they will never be transcribed: {sorted(oov)}")
+        return grammar
+
     def load_model(self, model_path):
         self.engine = self.get_model(model_path, self.samples)
 
@@ -98,6 +362,7 @@ class ModelContainer:
         self.load_model(model_path)
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def download_language(lang):
         lang = lang.split("-")[0].lower()
         model_path = ModelContainer.lang2modelurl(lang)
@@ -106,60 +371,49 @@ class ModelContainer:
         return model_path
 
     @staticmethod
-    def download_model(url):
-        folder = join(xdg_data_home(), 'vosk')
+    def url2model_path(url):
+        """ where download_model installs the model at the url """
         name = url.split("/")[-1].replace(".zip", "").replace(".tar.xz", "")
-        model_path = join(folder, name)
-        if not exists(model_path):
+        return join(xdg_data_home(), 'vosk', name)
+
+    @staticmethod
+    def download_model(url):
+        model_path = ModelContainer.url2model_path(url)
+        folder, name = os.path.split(model_path)
+        # plugins loading in parallel wait for the first download to finish
+        with download_lock(model_path):
+            if exists(model_path):
+                return model_path
             LOG.info(f"Downloading model for vosk {url}")
             LOG.info("this might take a while")
+            # extract next to the final location and move it in place once
+            # complete, an interrupted download never leaves a broken model
+            tmp_folder = model_path + ".partial"
+            if isdir(tmp_folder):
+                shutil.rmtree(tmp_folder)
             if url.endswith(".zip"):
-                download_extract_zip(url, folder=folder, skill_folder_name=name)
+                # kept between attempts so the download can be resumed
+                archive = join(folder, url.split("/")[-1] + ".partial")
+                download_resumable(url, archive)
+                try:
+                    extract_zip(archive, folder=tmp_folder,
+                                skill_folder_name=name)
+                finally:
+                    # a corrupt archive must not be resumed on the next try
+                    discard_download(archive)
             else:
-                download_extract_tar(url, folder=folder, skill_folder_name=name)
+                download_extract_tar(url, folder=tmp_folder, skill_folder_name=name)
+            os.replace(join(tmp_folder, name), model_path)
+            shutil.rmtree(tmp_folder)
             LOG.info(f"Model downloaded to {model_path}")
 
         return model_path
 
     @staticmethod
     def lang2modelurl(lang, small=True):
-        lang2url = {
-            "en": "http://alphacephei.com/vosk/models/vosk-model-small-en-us-0.15.zip",
-            "en-in": "http://alphacephei.com/vosk/models/vosk-model-small-en-in-0.4.zip",
-            "cn": "https://alphacephei.com/vosk/models/vosk-model-small-cn-0.3.zip",
-            "ru": "https://alphacephei.com/vosk/models/vosk-model-small-ru-0.15.zip",
-            "fr": "https://alphacephei.com/vosk/models/vosk-model-small-fr-pguyot-0.3.zip",
-            "de": "https://alphacephei.com/vosk/models/vosk-model-small-de-0.15.zip",
-            "es": "https://alphacephei.com/vosk/models/vosk-model-small-es-0.3.zip",
-            "pt": "https://alphacephei.com/vosk/models/vosk-model-small-pt-0.3.zip",
-            "gr": "https://alphacephei.com/vosk/models/vosk-model-el-gr-0.7.zip",
-            "tr": "https://alphacephei.com/vosk/models/vosk-model-small-tr-0.3.zip",
-            "vn": "https://alphacephei.com/vosk/models/vosk-model-small-vn-0.3.zip",
-            "it": "https://alphacephei.com/vosk/models/vosk-model-small-it-0.4.zip",
-            "nl": "https://alphacephei.com/vosk/models/vosk-model-nl-spraakherkenning-0.6-lgraph.zip",
-            "ca": "https://alphacephei.com/vosk/models/vosk-model-small-ca-0.4.zip",
-            "ar": "https://alphacephei.com/vosk/models/vosk-model-ar-mgb2-0.4.zip",
-            "fa": "https://alphacephei.com/vosk/models/vosk-model-small-fa-0.5.zip",
-            "tl": "https://alphacephei.com/vosk/models/vosk-model-tl-ph-generic-0.6.zip"
-        }
-        biglang2url = {
-            "en": "https://alphacephei.com/vosk/models/vosk-model-en-us-aspire-0.2.zip",
-            "en-in": "http://alphacephei.com/vosk/models/vosk-model-en-in-0.4.zip",
-            "cn": "https://alphacephei.com/vosk/models/vosk-model-cn-0.1.zip",
-            "ru": "https://alphacephei.com/vosk/models/vosk-model-ru-0.10.zip",
-            "fr": "https://github.com/pguyot/zamia-speech/releases/download/20190930/kaldi-generic-fr-tdnn_f-r20191016.tar.xz",
-            "de": "https://alphacephei.com/vosk/models/vosk-model-de-0.6.zip",
-            "nl": "https://alphacephei.com/vosk/models/vosk-model-nl-spraakherkenning-0.6.zip",
-            "fa": "https://alphacephei.com/vosk/models/vosk-model-fa-0.5.zip"
-
-        }
-        if not small:
-            lang2url.update(biglang2url)
         lang = lang.lower()
-        if lang in lang2url:
-            return lang2url[lang]
-        lang = lang.split("-")[0]
-        return lang2url.get(lang)
+        table = _SMALL_LANG2URL if small else _BIG_LANG2URL
+        return table.get(lang) or table.get(lang.split("-")[0])
 
 
 class VoskWakeWordPlugin(HotWordEngine):
@@ -171,22 +425,56 @@ class VoskWakeWordPlugin(HotWordEngine):
     def __init__(self, hotword="hey mycroft", config=None, lang="en-us"):
         config = config or {}
         super(VoskWakeWordPlugin, self).__init__(hotword, config, lang)
-        default_sample = [hotword.replace("_", " ").replace("-", " ")]
+        default_sample = [hotword.translate(_KW_NAME_TABLE)]
         self.full_vocab = self.config.get("full_vocab", False)
         self.samples = self.config.get("samples", default_sample)
-        self.rule = self.config.get("rule", MatchRule.EQUALS)
+        # normalized once, samples are matched on every check
+        self._norm_samples = tuple(s.lower().strip() for s in self.samples)
+        self.rule = MatchRule(self.config.get("rule", MatchRule.EQUALS))
         self.thresh = self.config.get("threshold", 0.75)
         self.debug = self.config.get("debug", False)
-        self.time_between_checks = \
-            min(self.config.get("time_between_checks", 1.0), 3)
+        self.energy_threshold = self.config.get("energy_threshold", 200)
+        self.sample_rate = self.config.get("sample_rate", 16000)
         self.expected_duration = self.MAX_EXPECTED_DURATION
-        self._counter = 0
-        self._load_model()
+        self._match = compile_rule(self._norm_samples, self.rule, self.thresh,
+                                   build_automaton(self._norm_samples, self.rule))
+        # exact string rules can only match if a sample is a substring of the
+        # raw vosk json, samples that json would escape are never prefiltered
+        self._min_len = min_match_len(self._norm_samples, self.rule)
+        self._prefilter = not self.debug and \
+            self.rule in _STRING_MATCHERS and \
+            all(s.isascii() and '"' not in s and "\\" not in s
+                for s in self._norm_samples)
+        self._in_utterance = False
+        # last quiet chunks, fed to vosk when speech starts so the soft
+        # beginning of the wake word is not cut off by the energy gate
+        self._preroll = deque(maxlen=2)
+        self._last_result = None
+        self._detected = False
+        # set by the decoder thread and cleared by found_wake_word
+        self._detected_lock = threading.Lock()
+        # models that must be downloaded first are loaded by the worker
+        # thread so startup is not blocked, audio is ignored until then
+        self.model = None
+        self._ready = threading.Event()
+        # set if the background download or load failed
+        self.load_error = None
+        if not self._needs_download():
+            self._load_model()
+            self._ready.set()
+        # audio is decoded in a worker thread so the mic loop never waits on
+        # vosk, the oldest chunks are dropped if the decoder falls behind
+        self._queue = queue.Queue(maxsize=8)
+        # the recognizer must not be reset while it is decoding
+        self._lock = threading.RLock()
+        self._worker = threading.Thread(target=self._decode_loop, daemon=True)
+        self._worker.start()
 
     def _load_model(self):
         # model_folder for backwards compat
         model_path = self.config.get("model") or self.config.get("model_folder")
-        self.model = ModelContainer(self.samples, self.full_vocab)
+        self.model = ModelContainer(self.samples, self.full_vocab,
+                                    self.sample_rate)
         if model_path:
             if model_path.startswith("http"):
                 model_path = ModelContainer.download_model(model_path)
@@ -194,82 +482,146 @@ class VoskWakeWordPlugin(HotWordEngine):
         else:
             self.model.load_language(self.lang)
 
-    def found_wake_word(self, frame_data):
-        """ frame data contains audio data that needs to be checked for a wake
-        word, you can process audio here or just return a result
-        previously handled in update method """
-        self._counter += self.SEC_BETWEEN_WW_CHECKS
-        if self._counter < self.time_between_checks:
-            return False
-        self._counter = 0
+    def _needs_download(self):
+        # model_folder for backwards compat
+        url = self.config.get("model") or self.config.get("model_folder") \
+            or ModelContainer.lang2modelurl(self.lang.split("-")[0].lower())
+        return bool(url) and url.startswith("http") and \
+            not exists(ModelContainer.url2model_path(url))
+
+    def update(self, chunk):
+        """ queue audio for the decoder thread, detections are reported by
+        found_wake_word """
+        if self._ready.is_set():
+            self._put(chunk)
+
+    def _put(self, chunk):
+        while True:
+            try:
+                self._queue.put_nowait(chunk)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                except queue.Empty:
+                    pass
+
+    def _decode_loop(self):
+        if not self._ready.is_set():
+            try:
+                self._load_model()
+            except Exception as e:
+                LOG.exception("Failed to download vosk model, "
+                              "the wake word will not be detected")
+                self.load_error = e
+                return
+            self._ready.set()
+        while True:
+            chunk = self._queue.get()
+            try:
+                if chunk is None:
+                    return
+                with self._lock:
+                    self._decode(chunk)
+            except:
+                LOG.exception("Failed to check audio for wake word")
+            finally:
+                self._queue.task_done()
+
+    def _decode(self, chunk):
+        """ stream audio into vosk as it arrives and check the partial
+        transcription """
+        # the decoder is only woken up by loud audio, once speech started it
+        # keeps receiving every chunk so vosk can detect the utterance end
+        if not self._in_utterance:
+            if audio_energy(chunk) < self.energy_threshold:
+                self._preroll.append(chunk)
+                return
+            self._in_utterance = True
+        model = self.model
+        lang = self.lang
+        samples = self._norm_samples
         try:
-            self.model.process_audio(frame_data, self.lang)
-            transcript = self.model.get_final_transcription(self.lang)
+            while self._preroll:
+                model.process_raw(self._preroll.popleft(), lang)
+            final = model.process_raw(chunk, lang)
+            if final:
+                self._in_utterance = False
+            res = model.get_result(lang, partial=not final)
         except:
             LOG.error("Failed to process audio")
-            return False
-        if not transcript or transcript == self.model.UNK:
-            return False
+            return
+        # the partial only changes when a new word is decoded, an unchanged
+        # result was already checked and can not produce a new detection
+        if res == self._last_result:
+            return
+        self._last_result = None if final else res
+        # skip parsing the result when no sample can possibly match
+        if self._prefilter and not any(s in res for s in samples):
+            return
+        transcript = parse_result(res, "text" if final else "partial")
+        if not transcript or transcript == model.UNK:
+            return
         if self.debug:
             LOG.debug("TRANSCRIPT: " + transcript)
-        return self.apply_rules(transcript, self.samples, self.rule, self.thresh)
+        if len(transcript) < self._min_len:
+            return
+        if self._match(transcript):
+            with self._detected_lock:
+                self._detected = True
+            self.reset()
+
+    def found_wake_word(self, frame_data=None):
+        """ audio is streamed to vosk in update, frame_data is ignored and
+        this only reports a detection made since the previous check """
+        with self._detected_lock:
+            found = self._detected
+            self._detected = False
+        return found
+
+    def reset(self):
+        # drop the decoder state so a detection does not trigger twice
+        if not self._ready.is_set():
+            return
+        with self._lock:
+            self._in_utterance = False
+            self._preroll.clear()
+            self._last_result = None
+            try:
+                self.model.reset(self.lang)
+            except:
+                LOG.error("Failed to reset vosk recognizer")
+
+    def stop(self):
+        self._put(None)
 
     @classmethod
-    def apply_rules(cls, transcript, samples, rule=MatchRule.FUZZY, thresh=0.75):
-        for s in samples:
-            s = s.lower().strip()
-            if rule == MatchRule.FUZZY:
-                score = fuzzy_match(s, transcript)
-                if score >= thresh:
-                    return True
-            elif rule == MatchRule.TOKEN_SORT_RATIO:
-                score = fuzzy_match(s, transcript,
-                                    strategy=MatchStrategy.TOKEN_SORT_RATIO)
-                if score >= thresh:
-                    return True
-            elif rule == MatchRule.TOKEN_SET_RATIO:
-                score = fuzzy_match(s, transcript,
-                                    strategy=MatchStrategy.TOKEN_SET_RATIO)
-                if score >= thresh:
-                    return True
-            elif rule == MatchRule.PARTIAL_TOKEN_SORT_RATIO:
-                score = fuzzy_match(s, transcript,
-                                    strategy=MatchStrategy.PARTIAL_TOKEN_SORT_RATIO)
-                if score >= thresh:
-                    return True
-            elif rule == MatchRule.PARTIAL_TOKEN_SET_RATIO:
-                score = fuzzy_match(s, transcript,
-                                    strategy=MatchStrategy.PARTIAL_TOKEN_SET_RATIO)
-                if score >= thresh:
-                    return True
-            elif rule == MatchRule.CONTAINS:
-                if s in transcript:
-                    return True
-            elif rule == MatchRule.EQUALS:
-                if s == transcript:
-                    return True
-            elif rule == MatchRule.STARTS:
-                if transcript.startswith(s):
-                    return True
-            elif rule == MatchRule.ENDS:
-                if transcript.endswith(s):
-                    return True
-        return False
+    def apply_rules(cls, transcript, samples, rule=MatchRule.FUZZY, thresh=0.75,
+                    automaton=None):
+        """ samples are expected to be already lowercased and stripped,
+        automaton is an optional build_automaton result for those samples """
+        return compile_rule(samples, rule, thresh, automaton)(transcript)
 
 
 class MultiLangModelContainer(ModelContainer):
-    engines = {}
-    models = {}
-    lang_samples = {}
 
-    def __init__(self, lang_samples=None, full_vocab=False, default_lang="en"):
+    def __init__(self, lang_samples=None, full_vocab=False, default_lang="en",
+                 sample_rate=16000):
         if not full_vocab and not lang_samples:
             full_vocab = True
+        # per instance, models must not be shared by unrelated plugins
+        self.engines = {}
+        self.models = {}
         lang = default_lang.split("-")[0].lower()
-        self.lang_samples = lang_samples or {lang: [self.UNK]}
-        samples = lang_samples[lang]
+        # every grammar needs [unk], or vosk forces any speech onto a keyword
+        self.lang_samples = {
+            l: list(samples) if self.UNK in samples
+            else list(samples) + [self.UNK]
+            for l, samples in (lang_samples or {lang: []}).items()}
+        samples = self.lang_samples.get(lang)
         self.default_lang = default_lang
-        super().__init__(samples, full_vocab)
+        super().__init__(samples, full_vocab, sample_rate)
 
     def get_engine(self, lang=None):
         lang = lang or self.default_lang
@@ -292,9 +644,13 @@ class MultiLangModelContainer(ModelContainer):
         self.load_model(model_path, lang)
 
     def unload_language(self, lang):
-        if lang in self.engines:
-            del self.engines[lang]
-            self.engines.pop(lang)
+        lang = lang.split("-")[0].lower()
+        engine = self.engines.pop(lang, None)
+        model_path = self.models.pop(lang, None)
+        self.recognizers = {k: r for k, r in self.recognizers.items()
+                            if r is not engine}
+        if model_path not in self.models.values():
+            self.kaldi_models.pop(model_path, None)
 
 
 class VoskMultiWakeWordPlugin(HotWordEngine):
@@ -313,8 +669,16 @@ class VoskMultiWakeWordPlugin(HotWordEngine):
         self.expected_duration = self.MAX_EXPECTED_DURATION
         self.full_vocab = self.config.get("full_vocab", False)
         self.debug = self.config.get("debug", False)
+        self.energy_threshold = self.config.get("energy_threshold", 200)
         self.time_between_checks = min(self.config.get("time_between_checks", 1.0), 3)
-        self._counter = 0
+        self.sample_rate = self.config.get("sample_rate", 16000)
+        # 16bit audio
+        self._min_bytes = int(self.sample_rate * 2 *
+                              self.config.get("min_audio_seconds", 0.5))
+        # checks are counted in whole calls, summing floats drifts
+        self._frames_per_check = max(1, round(self.time_between_checks /
+                                              self.SEC_BETWEEN_WW_CHECKS))
+        self._frames_since_check = 0
         self._load_model()
         # TODO refactor this, add native support to OPN
         self.bus = get_mycroft_bus()
@@ -324,68 +688,117 @@ class VoskMultiWakeWordPlugin(HotWordEngine):
         langs = [kw.get("lang", self.lang) for kw in self.keywords.values()]
         return list(set(langs))
 
-    @property
-    def samples(self):
-        samples = {lang.split("-")[0].lower(): [] for lang in self.langs}
+    def _load_model(self):
+        # samples are normalized once, they are matched on every check
+        self.samples = {lang.split("-")[0].lower(): [] for lang in self.langs}
+        # compile_rule matcher per keyword
+        self._kw_matchers = {}
+        self._kw_min_len = {}
+        # keywords grouped by lang, each model decodes once per check
+        self._lang_keywords = {}
         for kw_name, kw in self.keywords.items():
-            kw_name = kw_name.replace("_", " ").replace("-", " ")
+            name = kw_name.translate(_KW_NAME_TABLE)
+            samples = tuple(s.lower().strip() for s in kw.get("samples") or [name])
             lang = kw.get("lang") or self.lang
             lang = lang.split("-")[0].lower()
-            samples[lang] += kw.get("samples", [kw_name])
-        return samples
-
-    def _load_model(self):
+            self.samples[lang] += samples
+            rule = MatchRule(kw.get("rule") or MatchRule.EQUALS)
+            self._kw_min_len[kw_name] = min_match_len(samples, rule)
+            self._kw_matchers[kw_name] = compile_rule(
+                samples, rule, kw.get("threshold", 0.75),
+                build_automaton(samples, rule))
+            self._lang_keywords.setdefault(lang, []).append(kw_name)
         # keeps several models in memory per language
         self.model = MultiLangModelContainer(self.samples,
                                              self.full_vocab,
-                                             self.lang)
+                                             self.lang,
+                                             self.sample_rate)
         for lang in self.langs:
             self.model.load_language(lang)
+        # vosk releases the GIL while decoding, languages decode in parallel
+        if len(self._lang_keywords) > 1:
+            self._pool = ThreadPoolExecutor(
+                max_workers=len(self._lang_keywords))
+        else:
+            self._pool = None
+
+    def _decode_lang(self, pcm, lang):
+        try:
+            self.model.process_raw(pcm, lang)
+            return self.model.get_final_transcription(lang)
+        except:
+            LOG.error(f"Failed to process audio for lang: {lang}")
+            return None
 
     def found_wake_word(self, frame_data):
         """ frame data contains audio data that needs to be checked for a wake
         word, you can process audio here or just return a result
         previously handled in update method """
-        self._counter += self.SEC_BETWEEN_WW_CHECKS
-        if self._counter < self.time_between_checks:
+        self._frames_since_check += 1
+        if self._frames_since_check < self._frames_per_check:
             return False
-        self._counter = 0
-        txs = {}
-        for kw_name, kw in self.keywords.items():
-            lang = kw.get("lang") or self.lang
-            if lang in txs:
-                transcript = txs[lang]
-            else:
-                try:
-                    self.model.process_audio(frame_data, lang)
-                    transcript = self.model.get_final_transcription(lang)
-                except:
-                    LOG.error(f"Failed to process audio for lang: {lang}")
-                    continue
-            if not transcript or transcript == self.model.UNK:
+        self._frames_since_check = 0
+        if isinstance(frame_data, AudioData):
+            # converted once here instead of once per language
+            pcm = frame_data.get_raw_data(convert_rate=self.sample_rate,
+                                          convert_width=2)
+        else:
+            pcm = frame_data
+        # too short to contain a wake word, vosk has a fixed cost per call
+        if len(pcm) < self._min_bytes:
+            return False
+        # skip decoding silent audio for all languages
+        if audio_energy(pcm) < self.energy_threshold:
+            return False
+        if self._pool:
+            futures = {lang: self._pool.submit(self._decode_lang, pcm, lang)
+                       for lang in self._lang_keywords}
+            # wait for every model, a recognizer must not be fed concurrently
+            transcripts = {lang: f.result() for lang, f in futures.items()}
+        else:
+            transcripts = {lang: self._decode_lang(pcm, lang)
+                           for lang in self._lang_keywords}
+        kw_matchers = self._kw_matchers
+        kw_min_len = self._kw_min_len
+        unk = self.model.UNK
+        debug = self.debug
+        for lang, kw_names in self._lang_keywords.items():
+            transcript = transcripts[lang]
+            if not transcript or transcript == unk:
                 continue
-            if self.debug:
+            if debug:
                 LOG.debug(f"TRANSCRIPT {lang}: " + transcript)
-            samples = kw.get("samples") or [kw_name.replace("_", " ").replace("-", " ")]
-            rule = kw.get("rule") or MatchRule.EQUALS
-            thresh = kw.get("threshold", 0.75)
-            wakeup = kw.get("wakeup", False)
-            found = VoskWakeWordPlugin.apply_rules(transcript, samples, rule, thresh)
-            if found:
-                LOG.info(f"Detected kw: {kw_name}")
-                if self.debug:
-                    LOG.debug(str(kw))
-                if wakeup:
-                    self.bus.emit(Message('recognizer_loop:wake_up'))
-                    return False
-                return True
+            for kw_name in kw_names:
+                if len(transcript) < kw_min_len[kw_name]:
+                    continue
+                if kw_matchers[kw_name](transcript):
+                    kw = self.keywords[kw_name]
+                    LOG.info(f"Detected kw: {kw_name}")
+                    if debug:
+                        LOG.debug(str(kw))
+                    if kw.get("wakeup", False):
+                        self.bus.emit(Message('recognizer_loop:wake_up'))
+                        return False
+                    return True
         return False
 
+    def stop(self):
+        if self._pool:
+            self._pool.shutdown(wait=False)
+
+
+# shared session so model downloads reuse pooled connections
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+
 
 def download(url, file=None, session=None):
     """
     Pass file as a filename, open file object, or None to return the request bytes
 
+    The response is streamed in 1MB chunks instead of being held in memory
+
     Args:
         url (str): URL of file to download
         file (Union[str, io, None]): One of the following:
@@ -400,28 +813,98 @@ def download(url, file=None, session=None):
     if isinstance(file, str):
         file = open(file, 'wb')
     try:
-        if session:
-            content = session.get(url).content
-        else:
-            content = requests.get(url).content
-        if file:
-            file.write(content)
-        else:
-            return content
+        session = session or _SESSION
+        with session.get(url, stream=True, timeout=30) as r:
+            r.raise_for_status()
+            chunks = r.iter_content(chunk_size=1 << 20)
+            if file:
+                for chunk in chunks:
+                    file.write(chunk)
+            else:
+                return b"".join(chunks)
     finally:
         if file:
             file.close()
 
 
+def download_resumable(url, filename, session=None):
+    """
+    Download the url to filename, continuing from the data a previous
+    interrupted download left in filename
+
+    The ETag or Last-Modified of the first response is kept next to the
+    file in filename + ".validator", a download is only resumed if the
+    file did not change on the server, otherwise it starts over
+
+    Args:
+        url (str): URL of file to download
+        filename (str): Location of output file
+    """
+    makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    validator_file = filename + ".validator"
+    offset = os.path.getsize(filename) if exists(filename) else 0
+    validator = None
+    if offset and exists(validator_file):
+        with open(validator_file) as f:
+            validator = f.read().strip()
+    headers = {}
+    if validator:
+        # If-Range makes the server send the whole file if it changed
+        headers = {"Range": f"bytes={offset}-", "If-Range": validator}
+    else:
+        offset = 0  # the data on disk can not be verified
+    session = session or _SESSION
+    with session.get(url, headers=headers, stream=True, timeout=30) as r:
+        if offset and r.status_code == 416:
+            # only complete if the server reports the size we already have
+            if r.headers.get("Content-Range") == f"bytes */{offset}":
+                return
+            restart = True
+        else:
+            r.raise_for_status()
+            restart = r.status_code == 206 and not r.headers.get(
+                "Content-Range", "").startswith(f"bytes {offset}-")
+        if not restart:
+            # servers that ignore the range send the whole file again
+            mode = "ab" if r.status_code == 206 else "wb"
+            if mode == "wb":
+                etag = r.headers.get("ETag")
+                # weak etags can not be used in If-Range
+                if etag and etag.startswith("W/"):
+                    etag = None
+                validator = etag or r.headers.get("Last-Modified")
+                if validator:
+                    with open(validator_file, "w") as f:
+                        f.write(validator)
+                elif exists(validator_file):
+                    os.remove(validator_file)
+            with open(filename, mode) as f:
+                for chunk in r.iter_content(chunk_size=1 << 20):
+                    f.write(chunk)
+            return
+    # the server answered for another version of the file, start over
+    discard_download(filename)
+    download_resumable(url, filename, session)
+
+
+def discard_download(filename):
+    """ remove a download_resumable file and its validator """
+    for f in (filename, filename + ".validator"):
+        if exists(f):
+            os.remove(f)
+
+
 def download_extract_tar(tar_url, folder, tar_filename='',
                          skill_folder_name=None, session=None):
     """
     Download and extract the tar at the url to the given folder
 
+    Without tar_filename the archive is extracted while it downloads
+
     Args:
         tar_url (str): URL of tar file to download
         folder (str): Location of parent directory to extract to. Doesn't have to exist
-        tar_filename (str): Location to download tar. Default is to a temp file
+        tar_filename (str): Location to download tar. Default is to stream it
         skill_folder_name (str): rename extracted skill folder to this
     """
     try:
@@ -429,20 +912,25 @@ def download_extract_tar(tar_url, folder, tar_filename='',
     except OSError:
         if not isdir(folder):
             raise
-    if not tar_filename:
-        fd, tar_filename = mkstemp('.tar.gz')
-        download(tar_url, os.fdopen(fd, 'wb'), session=session)
-    else:
+    if tar_filename:
         download(tar_url, tar_filename, session=session)
-
-    with tarfile.open(tar_filename) as tar:
-        tar.extractall(path=folder)
+        with tarfile.open(tar_filename) as tar:
+            original_folder = tar.getnames()[0].split("/")[0]
+            tar.extractall(path=folder)
+    else:
+        original_folder = None
+        session = session or _SESSION
+        with session.get(tar_url, stream=True, timeout=30) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            # stream mode, members are extracted as they are received
+            with tarfile.open(fileobj=r.raw, mode="r|*") as tar:
+                for member in tar:
+                    if original_folder is None:
+                        original_folder = member.name.split("/")[0]
+                    tar.extract(member, path=folder)
 
     if skill_folder_name:
-        with tarfile.open(tar_filename) as tar:
-            for p in tar.getnames():
-                original_folder = p.split("/")[0]
-                break
         original_folder = join(folder, original_folder)
         final_folder = join(folder, skill_folder_name)
         shutil.move(original_folder, final_folder)
@@ -469,16 +957,23 @@ def download_extract_zip(zip_url, folder, zip_filename="",
         download(zip_url, os.fdopen(fd, 'wb'), session=session)
     else:
         download(zip_url, zip_filename, session=session)
+    extract_zip(zip_filename, folder, skill_folder_name)
+
+
+def extract_zip(zip_filename, folder, skill_folder_name=None):
+    """
+    Extract a local zip file to the given folder
 
+    Args:
+        zip_filename (str): Location of the zip file
+        folder (str): Location of parent directory to extract to. Doesn't have to exist
+        skill_folder_name (str): rename extracted skill folder to this
+    """
     with zipfile.ZipFile(zip_filename, 'r') as zip_ref:
+        original_folder = zip_ref.namelist()[0].split("/")[0]
         zip_ref.extractall(folder)
 
     if skill_folder_name:
-        with zipfile.ZipFile(zip_filename, 'r') as zip_ref:
-            for p in zip_ref.namelist():
-                original_folder = p.split("/")[0]
-                break
-
         original_folder = join(folder, original_folder)
         final_folder = join(folder, skill_folder_name)
         shutil.move(original_folder, final_folder)
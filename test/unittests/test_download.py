@@ -0,0 +1,138 @@
+import os
+import tempfile
+import unittest
+
+from ovos_ww_plugin_vosk import download_resumable
+
+DATA = bytes(range(256)) * 4
+ETAG = '"v1"'
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=b"", headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError(self.status_code)
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+
+class FakeSession:
+    """ serves DATA honoring Range and If-Range, responses can be queued
+    to simulate misbehaving servers """
+
+    def __init__(self, *responses, etag=ETAG):
+        self.responses = list(responses)
+        self.etag = etag
+        self.requests = []
+
+    def get(self, url, headers=None, **kwargs):
+        headers = headers or {}
+        self.requests.append(headers)
+        if self.responses:
+            return self.responses.pop(0)
+        rng = headers.get("Range")
+        if rng and headers.get("If-Range") == self.etag:
+            start = int(rng[len("bytes="):-1])
+            if start >= len(DATA):
+                return FakeResponse(416, headers={
+                    "Content-Range": f"bytes */{len(DATA)}"})
+            return FakeResponse(206, DATA[start:], {
+                "Content-Range": f"bytes {start}-{len(DATA) - 1}/{len(DATA)}"})
+        return FakeResponse(200, DATA, {"ETag": self.etag})
+
+
+class TestDownloadResumable(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.folder.name, "model.zip.partial")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def write(self, data, validator=None):
+        with open(self.file, "wb") as f:
+            f.write(data)
+        if validator:
+            with open(self.file + ".validator", "w") as f:
+                f.write(validator)
+
+    def read(self):
+        with open(self.file, "rb") as f:
+            return f.read()
+
+    def test_fresh_download(self):
+        session = FakeSession()
+        download_resumable("http://x/model.zip", self.file, session)
+        self.assertEqual(self.read(), DATA)
+        self.assertEqual(session.requests, [{}])
+        with open(self.file + ".validator") as f:
+            self.assertEqual(f.read(), ETAG)
+
+    def test_resume(self):
+        self.write(DATA[:100], ETAG)
+        session = FakeSession()
+        download_resumable("http://x/model.zip", self.file, session)
+        self.assertEqual(self.read(), DATA)
+        self.assertEqual(session.requests,
+                         [{"Range": "bytes=100-", "If-Range": ETAG}])
+
+    def test_complete_416(self):
+        self.write(DATA, ETAG)
+        session = FakeSession()
+        download_resumable("http://x/model.zip", self.file, session)
+        self.assertEqual(self.read(), DATA)
+        self.assertEqual(len(session.requests), 1)
+
+    def test_416_other_size_restarts(self):
+        self.write(DATA + b"garbage", ETAG)
+        session = FakeSession()
+        download_resumable("http://x/model.zip", self.file, session)
+        self.assertEqual(self.read(), DATA)
+        self.assertEqual(session.requests[-1], {})
+
+    def test_changed_file_sends_whole_file(self):
+        self.write(b"old version", '"v0"')
+        session = FakeSession()
+        download_resumable("http://x/model.zip", self.file, session)
+        self.assertEqual(self.read(), DATA)
+        self.assertEqual(len(session.requests), 1)
+
+    def test_mismatched_range_restarts(self):
+        self.write(DATA[:100], ETAG)
+        bad = FakeResponse(206, DATA[50:], {
+            "Content-Range": f"bytes 50-{len(DATA) - 1}/{len(DATA)}"})
+        session = FakeSession(bad)
+        download_resumable("http://x/model.zip", self.file, session)
+        self.assertEqual(self.read(), DATA)
+        self.assertEqual(session.requests[-1], {})
+
+    def test_no_validator_is_not_resumed(self):
+        self.write(b"<html>captive portal</html>")
+        session = FakeSession()
+        download_resumable("http://x/model.zip", self.file, session)
+        self.assertEqual(self.read(), DATA)
+        self.assertEqual(session.requests, [{}])
+
+    def test_weak_etag_not_stored(self):
+        session = FakeSession(etag='W/"v1"')
+        download_resumable("http://x/model.zip", self.file, session)
+        self.assertEqual(self.read(), DATA)
+        self.assertFalse(os.path.exists(self.file + ".validator"))
+
+    def test_http_error_raises(self):
+        session = FakeSession(FakeResponse(404))
+        with self.assertRaises(IOError):
+            download_resumable("http://x/model.zip", self.file, session)
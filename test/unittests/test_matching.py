@@ -0,0 +1,78 @@
+import json
+import unittest
+
+from ovos_ww_plugin_vosk import MatchRule, build_automaton, compile_rule, \
+    parse_result
+
+
+def vosk_result(key, text):
+    # vosk formats results with 2 spaces indent and " : " separators
+    return json.dumps({key: text}, indent=2).replace('":', '" :')
+
+
+class TestParseResult(unittest.TestCase):
+    def test_text(self):
+        self.assertEqual(parse_result(vosk_result("text", "hey mycroft")),
+                         "hey mycroft")
+
+    def test_partial(self):
+        res = vosk_result("partial", "hey")
+        self.assertEqual(parse_result(res, "partial"), "hey")
+
+    def test_empty(self):
+        self.assertEqual(parse_result(vosk_result("text", "")), "")
+
+    def test_escaped_text_falls_back_to_json(self):
+        res = vosk_result("text", 'say "hi" \\ there')
+        self.assertEqual(parse_result(res), 'say "hi" \\ there')
+
+    def test_other_format(self):
+        self.assertEqual(parse_result('{"text":"hey"}'), "hey")
+
+    def test_unicode(self):
+        res = vosk_result("text", "olá computador")
+        self.assertEqual(parse_result(res), "olá computador")
+
+
+class TestCompileRule(unittest.TestCase):
+    SAMPLES = ("hey mycroft", "hey computer")
+    TRANSCRIPTS = ("hey mycroft", "oh hey mycroft", "hey mycroft now",
+                   "hey micro soft", "nothing")
+    EXPECTED = {
+        MatchRule.CONTAINS: [True, True, True, False, False],
+        MatchRule.EQUALS: [True, False, False, False, False],
+        MatchRule.STARTS: [True, False, True, False, False],
+        MatchRule.ENDS: [True, True, False, False, False],
+        MatchRule.FUZZY: [True, True, True, True, False]
+    }
+
+    def check(self, rule, automaton=None):
+        match = compile_rule(self.SAMPLES, rule, 0.75, automaton)
+        self.assertEqual([match(t) for t in self.TRANSCRIPTS],
+                         self.EXPECTED[rule], rule)
+
+    def test_rules(self):
+        for rule in self.EXPECTED:
+            self.check(rule)
+
+    def test_rules_with_automaton(self):
+        for rule in self.EXPECTED:
+            self.check(rule, build_automaton(self.SAMPLES, rule))
+
+    def test_fuzzy_threshold(self):
+        match = compile_rule(self.SAMPLES, MatchRule.FUZZY, 0.99)
+        self.assertTrue(match("hey mycroft"))
+        self.assertFalse(match("hey micro soft"))
+
+    def test_no_samples(self):
+        for rule in MatchRule:
+            match = compile_rule((), rule,
+                                 automaton=build_automaton((), rule))
+            self.assertFalse(match("hey mycroft"), rule)
+
+    def test_empty_sample_matches_anything(self):
+        for rule in (MatchRule.CONTAINS, MatchRule.STARTS, MatchRule.ENDS):
+            samples = ("hey mycroft", "")
+            match = compile_rule(samples, rule,
+                                 automaton=build_automaton(samples, rule))
+            self.assertTrue(match("anything"), rule)